@@ -0,0 +1,242 @@
+"""
+Module for archiving historical runs into a columnar store. Every run writes its
+feeds into `data/<spider>/<timestamp>.csv/.json/.xml`, this module compacts them into
+Parquet files partitioned by spider and run timestamp, and queries them reading only
+the columns and partitions that are needed.
+
+Archive layout:
+    <archive_dir>/spider=<spider>/run=<timestamp>/part-0.parquet
+"""
+
+import csv
+import json
+import re
+import xml.etree.ElementTree as ET
+from pathlib import Path
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+
+# Run files are named after the CURRENT_TIME of the feeds, e.g. 20240616_115214
+RUN_PATTERN = re.compile(r"^\d{8}_\d{6}$")
+
+# Feed formats from the most to the least typed, the first one found is archived
+FEED_FORMATS = ["json", "csv", "xml"]
+
+FILTER_PATTERN = re.compile(r"^\s*(\w+)\s*(==|=|!=|<=|>=|<|>|~)\s*(.*)$")
+
+
+def _read_json(path):
+    """Read items from a JSON feed file."""
+    with open(path, encoding="utf-8-sig") as f:
+        return json.load(f)
+
+
+def _read_csv(path):
+    """Read items from a CSV feed file, empty cells being missing values."""
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        return [{k: v if v != "" else None for k, v in row.items()} for row in csv.DictReader(f)]
+
+
+def _read_xml(path):
+    """Read items from a XML feed file."""
+    root = ET.fromstring(Path(path).read_bytes().decode("utf-8-sig").split("?>", 1)[-1])
+    return [{field.tag: field.text for field in item} for item in root.iter("item")]
+
+
+READERS = {"json": _read_json, "csv": _read_csv, "xml": _read_xml}
+
+
+def find_runs(data_dir):
+    """
+    Find run files in the data directory.
+
+    Returns:
+        dict: Mapping of (spider, run) to the path of the most typed feed file.
+    """
+
+    runs = {}
+    for spider_dir in sorted(Path(data_dir).iterdir()):
+        if not spider_dir.is_dir():
+            continue
+        for extension in reversed(FEED_FORMATS):
+            for path in spider_dir.glob(f"*.{extension}"):
+                if RUN_PATTERN.match(path.stem):
+                    runs[(spider_dir.name, path.stem)] = path
+    return runs
+
+
+def _promote(old_type, new_type):
+    """
+    Get a type that can hold values of both types: a null column takes the other
+    type, mixed numbers become floats and anything else mismatching becomes strings.
+    """
+
+    if old_type == new_type or pa.types.is_null(new_type):
+        return old_type
+    if pa.types.is_null(old_type):
+        return new_type
+
+    def is_number(t):
+        return pa.types.is_integer(t) or pa.types.is_floating(t)
+
+    if is_number(old_type) and is_number(new_type):
+        return pa.float64()
+    return pa.string()
+
+
+def unify_schemas(schemas):
+    """Merge schemas, promoting the types of columns that drifted between runs."""
+    types = {}
+    for schema in schemas:
+        for field in schema:
+            if field.name in types:
+                types[field.name] = _promote(types[field.name], field.type)
+            else:
+                types[field.name] = field.type
+    return pa.schema(list(types.items()))
+
+
+def _conform(table, schema):
+    """
+    Cast a table to the unified schema of its spider, adding missing columns as nulls,
+    so that every partition of a spider can be read as one dataset.
+    """
+
+    columns = []
+    for field in schema:
+        if field.name in table.column_names:
+            columns.append(table[field.name].cast(field.type))
+        else:
+            columns.append(pa.nulls(len(table), field.type))
+    return pa.Table.from_arrays(columns, schema=schema)
+
+
+def _spider_schemas(archive_dir, spider):
+    """Get the schemas of the runs already archived for a spider."""
+    files = sorted(Path(archive_dir, f"spider={spider}").glob("run=*/*.parquet"))
+    return [pq.read_schema(path) for path in files]
+
+
+def compact(data_dir, archive_dir, overwrite=False):
+    """
+    Archive every run of the data directory that is not archived yet. A run that
+    can't be read or converted is skipped, the other runs are still archived.
+
+    Returns:
+        tuple: The (spider, run, number of items) of the archived runs, and the
+        (spider, run, reason) of the skipped runs.
+    """
+
+    archived = []
+    skipped = []
+    for (spider, run), path in sorted(find_runs(data_dir).items()):
+        partition = Path(archive_dir, f"spider={spider}", f"run={run}")
+        if partition.exists() and not overwrite:
+            continue
+
+        try:
+            items = READERS[path.suffix[1:]](path)
+            if not items:
+                continue
+            # from_pylist only takes the columns of the first item, use every item's
+            columns = dict.fromkeys(key for item in items for key in item)
+            table = pa.Table.from_pydict({key: [item.get(key) for item in items] for key in columns})
+            schemas = _spider_schemas(archive_dir, spider) + [table.schema]
+            table = _conform(table, unify_schemas(schemas))
+        except (pa.ArrowException, ValueError, SyntaxError) as e:
+            skipped.append((spider, run, f"{type(e).__name__}: {e}"))
+            continue
+
+        partition.mkdir(parents=True, exist_ok=True)
+        pq.write_table(table, partition / "part-0.parquet", compression="zstd")
+        archived.append((spider, run, table.num_rows))
+    return archived, skipped
+
+
+def _parse_value(value, field_type):
+    """Convert a filter value given on the command line to the column type."""
+    if pa.types.is_integer(field_type):
+        return int(value)
+    if pa.types.is_floating(field_type):
+        return float(value)
+    if pa.types.is_boolean(field_type):
+        return value.lower() in ("1", "true", "yes")
+    return value
+
+
+def parse_filter(expression, schema):
+    """
+    Parse a filter such as `title=A Light in the Attic` or `price<20` into a
+    dataset expression. `~` matches values of a string column containing a substring.
+    """
+
+    match = FILTER_PATTERN.match(expression)
+    if not match:
+        raise ValueError(f"Invalid filter: {expression}")
+
+    name, operator, value = match.groups()
+    if name not in schema.names:
+        raise ValueError(f"Unknown column: {name}")
+
+    field = ds.field(name)
+    field_type = schema.field(name).type
+    if operator == "~":
+        if not (pa.types.is_string(field_type) or pa.types.is_large_string(field_type)):
+            raise ValueError(f"~ needs a string column: {name} is {field_type}")
+        return pc.match_substring(field, value)
+
+    value = _parse_value(value, field_type)
+    if operator in ("=", "=="):
+        return field == value
+    if operator == "!=":
+        return field != value
+    if operator == "<":
+        return field < value
+    if operator == "<=":
+        return field <= value
+    if operator == ">":
+        return field > value
+    return field >= value
+
+
+def query(archive_dir, spider, columns=None, filters=(), since=None, until=None):
+    """
+    Query the archived runs of a spider.
+
+    Only the partitions of the spider within the since/until run range are opened,
+    and filters are pushed down to the Parquet row groups, so only the requested
+    columns of the matching rows are read.
+
+    Returns:
+        pyarrow.Table: The matching rows, with a `run` column.
+    """
+
+    spider_dir = Path(archive_dir, f"spider={spider}")
+    if not spider_dir.is_dir():
+        raise ValueError(f"No archived runs for spider: {spider}")
+
+    # Columns added or promoted by later runs are read from every partition
+    run_schema = pa.schema([("run", pa.string())])
+    schema = unify_schemas(_spider_schemas(archive_dir, spider) + [run_schema])
+    dataset = ds.dataset(
+        spider_dir,
+        schema=schema,
+        format="parquet",
+        partitioning=ds.partitioning(run_schema, flavor="hive"),
+    )
+
+    expression = None
+    conditions = [parse_filter(f, dataset.schema) for f in filters]
+    if since:
+        conditions.append(ds.field("run") >= since)
+    if until:
+        conditions.append(ds.field("run") <= until)
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+
+    if columns:
+        columns = ["run"] + [c for c in columns if c != "run"]
+    return dataset.to_table(columns=columns or None, filter=expression)
@@ -0,0 +1,5 @@
+# This package contains the custom commands of the scraper project, see
+# COMMANDS_MODULE in settings.py.
+#
+# Please refer to the documentation for information on how to create custom commands:
+# https://docs.scrapy.org/en/latest/topics/commands.html#custom-project-commands
@@ -0,0 +1,35 @@
+"""
+This module contains the `scrapy compact` command, which archives the run files
+of every spider under `data/` into the columnar archive.
+"""
+
+from scrapy.commands import ScrapyCommand
+from scraper.archive import compact
+
+
+class Command(ScrapyCommand):
+    """Command for compacting run files into the archive."""
+
+    requires_project = True
+    default_settings = {"LOG_ENABLED": False}
+
+    def short_desc(self):
+        return "Compact run files of data/ into the columnar archive"
+
+    def add_options(self, parser):
+        super().add_options(parser)
+        parser.add_argument(
+            "--overwrite", action="store_true", help="archive again runs that are already archived"
+        )
+
+    def run(self, args, opts):
+        archived, skipped = compact(
+            self.settings.get("ARCHIVE_DATA_DIR"),
+            self.settings.get("ARCHIVE_DIR"),
+            overwrite=opts.overwrite,
+        )
+        for spider, run, count in archived:
+            print(f"{spider} {run}: {count} items")
+        for spider, run, reason in skipped:
+            print(f"{spider} {run}: skipped, {reason}")
+        print(f"Archived {len(archived)} runs, skipped {len(skipped)} runs")
@@ -0,0 +1,71 @@
+"""
+This module contains the `scrapy history` command, which queries the archived runs
+of a spider, e.g. the price of a book across runs:
+
+    scrapy history toscrape -c title,price -w "title=A Light in the Attic"
+"""
+
+import sys
+from scrapy.commands import ScrapyCommand
+from scrapy.exceptions import UsageError
+from pyarrow import csv as pa_csv
+import pyarrow.parquet as pq
+from scraper.archive import query
+
+
+class Command(ScrapyCommand):
+    """Command for querying the archived runs of a spider."""
+
+    requires_project = True
+    default_settings = {"LOG_ENABLED": False}
+
+    def syntax(self):
+        return "[options] <spider>"
+
+    def short_desc(self):
+        return "Query the archived runs of a spider"
+
+    def long_desc(self):
+        return (
+            "Query the archived runs of a spider. Filters are written as "
+            "<column><operator><value>, where operator is one of = != < <= > >= "
+            "or ~ (contains). Only the selected columns and runs are read."
+        )
+
+    def add_options(self, parser):
+        super().add_options(parser)
+        parser.add_argument(
+            "-c", "--columns", help="comma separated columns to read (default: all)"
+        )
+        parser.add_argument(
+            "-w", "--where", action="append", default=[], help="filter rows, can be repeated"
+        )
+        parser.add_argument("--since", help="first run to read, e.g. 20240616_000000")
+        parser.add_argument("--until", help="last run to read, e.g. 20240630_235959")
+        parser.add_argument(
+            "-O", "--output", help="write the rows to a .csv or .parquet file instead of stdout"
+        )
+
+    def run(self, args, opts):
+        if len(args) != 1:
+            raise UsageError()
+
+        columns = opts.columns.split(",") if opts.columns else None
+        try:
+            table = query(
+                self.settings.get("ARCHIVE_DIR"),
+                args[0],
+                columns=columns,
+                filters=opts.where,
+                since=opts.since,
+                until=opts.until,
+            )
+        except ValueError as e:
+            raise UsageError(str(e), print_help=False)
+
+        if opts.output and opts.output.endswith(".parquet"):
+            pq.write_table(table, opts.output)
+        elif opts.output:
+            pa_csv.write_csv(table, opts.output)
+        else:
+            pa_csv.write_csv(table, sys.stdout.buffer)
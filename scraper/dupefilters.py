@@ -0,0 +1,148 @@
+"""
+Module for defining duplicate request filters. This module contains a disk-backed
+dupefilter for very large crawls, where the default in-memory fingerprint set of
+Scrapy would grow without limit as spiders follow pages.
+
+Dupefilters:
+- BloomDupeFilter: Bloom filter in memory, in front of a SQLite fingerprint store on disk.
+"""
+
+import math
+import shutil
+import sqlite3
+import tempfile
+from pathlib import Path
+from scrapy.dupefilters import RFPDupeFilter
+from scrapy.utils.job import job_dir
+
+
+class BloomDupeFilter(RFPDupeFilter):
+    """
+    Request fingerprint dupefilter with a fixed size memory footprint.
+
+    Every fingerprint is first checked against a Bloom filter whose size only
+    depends on DUPEFILTER_BLOOM_CAPACITY and DUPEFILTER_BLOOM_ERROR_RATE. A negative
+    answer means the request is new, so the on-disk store is only queried when the
+    Bloom filter reports a (possibly false) positive.
+
+    When JOBDIR is set, the store and the Bloom filter bits are kept there and are
+    reloaded on the next run, otherwise they live in a temporary directory that is
+    removed when the spider closes.
+    """
+
+    commit_every = 1000
+
+    def __init__(self, path=None, debug=False, *, fingerprinter=None,
+                 capacity=10_000_000, error_rate=0.001):
+        # Let the parent set up fingerprinter and logging, but not its own
+        # in-memory set and requests.seen file.
+        super().__init__(None, debug, fingerprinter=fingerprinter)
+        self.fingerprints = None
+
+        self.tmpdir = None
+        if not path:
+            self.tmpdir = tempfile.mkdtemp(prefix="scraper-dupefilter-")
+            path = self.tmpdir
+
+        # Optimal Bloom filter size (bits) and number of hash functions
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bloom_path = Path(path, "requests.seen.bloom")
+        self.db_path = Path(path, "requests.seen.db")
+
+        self.connection = sqlite3.connect(self.db_path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("PRAGMA cache_size=-16000")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS fingerprints (fp BLOB PRIMARY KEY) WITHOUT ROWID"
+        )
+        self.pending = 0
+        self.bloom = self._load_bloom()
+
+    @classmethod
+    def from_settings(cls, settings, *, fingerprinter=None):
+        return cls(
+            job_dir(settings),
+            settings.getbool("DUPEFILTER_DEBUG"),
+            fingerprinter=fingerprinter,
+            capacity=settings.getint("DUPEFILTER_BLOOM_CAPACITY", 10_000_000),
+            error_rate=settings.getfloat("DUPEFILTER_BLOOM_ERROR_RATE", 0.001),
+        )
+
+    def _load_bloom(self):
+        """
+        Load the Bloom filter bits saved by a previous run, or rebuild them from the
+        fingerprint store when the saved bits are missing or were sized differently.
+        """
+
+        size = (self.num_bits + 7) // 8
+        if self.bloom_path.exists():
+            bloom = bytearray(self.bloom_path.read_bytes())
+            # Only a clean close writes the bits again, so a crashed run is
+            # rebuilt from the store on the next start instead of trusting stale bits
+            self.bloom_path.unlink()
+            if len(bloom) == size:
+                return bloom
+
+        self.bloom = bytearray(size)
+        for (fp,) in self.connection.execute("SELECT fp FROM fingerprints"):
+            self._bloom_add(fp)
+        return self.bloom
+
+    def _bloom_positions(self, fp):
+        """
+        Derive the bit positions of a fingerprint with double hashing. Request
+        fingerprints are already uniformly distributed hashes, so their bytes are
+        used directly instead of hashing them again.
+        """
+
+        h1 = int.from_bytes(fp[:8], "little")
+        h2 = int.from_bytes(fp[8:16], "little") | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def _bloom_add(self, fp):
+        """
+        Set the bits of a fingerprint, returning True if they were all set already.
+        """
+
+        seen = True
+        for position in self._bloom_positions(fp):
+            byte, mask = position >> 3, 1 << (position & 7)
+            if not self.bloom[byte] & mask:
+                self.bloom[byte] |= mask
+                seen = False
+        return seen
+
+    def request_seen(self, request):
+        """
+        Return True if the request was already seen, recording it otherwise.
+        """
+
+        fp = self.fingerprinter.fingerprint(request)
+        if self._bloom_add(fp):
+            # Possibly a false positive, the store has the final word
+            row = self.connection.execute(
+                "SELECT 1 FROM fingerprints WHERE fp = ?", (fp,)
+            ).fetchone()
+            if row is not None:
+                return True
+
+        self.connection.execute("INSERT OR IGNORE INTO fingerprints (fp) VALUES (?)", (fp,))
+        self.pending += 1
+        if self.pending >= self.commit_every:
+            self.connection.commit()
+            self.pending = 0
+        return False
+
+    def close(self, reason):
+        """
+        Flush the fingerprint store and save the Bloom filter bits for the next run.
+        """
+
+        self.connection.commit()
+        self.connection.close()
+        if self.tmpdir:
+            shutil.rmtree(self.tmpdir, ignore_errors=True)
+        else:
+            self.bloom_path.write_bytes(self.bloom)
@@ -0,0 +1,230 @@
+"""
+Module for defining extensions. This module contains extensions that hook into the
+crawler signals to add behaviour that is not tied to a single spider.
+
+Extensions:
+- SamplingProfiler: Low overhead sampling profiler attributing CPU time to spider callbacks and pipelines.
+"""
+
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import Path
+from urllib.parse import urlparse
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+
+
+class SamplingProfiler:
+    """
+    Extension for sampling the stack of the crawler thread.
+
+    A background thread samples the stack every PROFILER_INTERVAL seconds and
+    attributes it to the innermost spider callback, item pipeline or feed exporter
+    found in it, anything else being Scrapy internals. When PROFILER_CALLBACKS or
+    PROFILER_PIPELINES are set, only samples attributed to them are kept.
+
+    Each sample is weighted by the CPU time the thread used since the previous one,
+    and samples taken while the thread waits for the network (no CPU time used)
+    are dropped. Where per-thread CPU clocks are not available, wall time is used.
+
+    On close, the samples are written in collapsed stack format (for flamegraph.pl
+    or speedscope, weights in microseconds of CPU time) next to the feed files, and
+    the CPU time of each callback and pipeline is added to the stats.
+    """
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        if not settings.getbool("PROFILER_ENABLED"):
+            raise NotConfigured("Profiler is disabled")
+
+        self.crawler = crawler
+        self.interval = settings.getfloat("PROFILER_INTERVAL", 0.01)
+        self.callbacks = set(settings.getlist("PROFILER_CALLBACKS"))
+        self.pipelines = set(settings.getlist("PROFILER_PIPELINES"))
+        self.labels = {}
+        self.stacks = Counter()
+        self.cpu_times = Counter()
+        self.samples = 0
+        self.thread_id = None
+        self.running = threading.Event()
+        self.sampler = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        """Initialize the extension and connect signals."""
+        instance = cls(crawler)
+        crawler.signals.connect(instance.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(instance.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(instance.request_scheduled, signal=signals.request_scheduled)
+        return instance
+
+    def _label_callback(self, callback):
+        """
+        Label the code object of a spider callback or errback.
+        """
+
+        func = getattr(callback, "__func__", callback)
+        code = getattr(func, "__code__", None)
+        if code is None or code in self.labels:
+            return
+        if not (self.callbacks or self.pipelines) or func.__name__ in self.callbacks:
+            self.labels[code] = f"callback/{func.__name__}"
+
+    def _collect_labels(self, spider):
+        """
+        Map the code objects of the default spider callback and of pipeline methods
+        to their labels. Other callbacks are labelled as requests using them are
+        scheduled.
+        """
+
+        self._label_callback(getattr(spider, "parse", None))
+
+        selective = self.callbacks or self.pipelines
+        for pipeline in self.crawler.engine.scraper.itemproc.middlewares:
+            name = type(pipeline).__name__
+            if selective and name not in self.pipelines:
+                continue
+            for value in vars(type(pipeline)).values():
+                if callable(value) and hasattr(value, "__code__"):
+                    self.labels[value.__code__] = f"pipeline/{name}"
+
+    def request_scheduled(self, request, spider):
+        """
+        Label the callback and errback of a scheduled request.
+        """
+
+        for callback in (request.callback, request.errback):
+            if callback is not None:
+                self._label_callback(callback)
+
+    def _label(self, frame):
+        """
+        Get the label of the innermost attributed frame of a stack.
+        """
+
+        while frame is not None:
+            code = frame.f_code
+            label = self.labels.get(code)
+            if label:
+                return label
+            if "scrapy/exporters" in code.co_filename.replace("\\", "/"):
+                return None if self.callbacks or self.pipelines else "feedexport"
+            frame = frame.f_back
+        return None if self.callbacks or self.pipelines else "scrapy"
+
+    @staticmethod
+    def _collapse(frame):
+        """Format a stack from the outermost to the innermost frame."""
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{Path(code.co_filename).stem}:{code.co_name}")
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+    def _cpu_clock(self):
+        """
+        Get a function returning the CPU time of the crawler thread, falling back
+        to wall time where per-thread CPU clocks are not available (e.g. Windows).
+
+        Returns:
+            tuple: The clock function, and whether it measures CPU time.
+        """
+
+        try:
+            clock_id = time.pthread_getcpuclockid(self.thread_id)
+            time.clock_gettime(clock_id)
+            return lambda: time.clock_gettime(clock_id), True
+        except (AttributeError, OSError):
+            return time.perf_counter, False
+
+    def _sample(self):
+        """
+        Sample the crawler thread until the spider is closed.
+        """
+
+        clock, is_cpu = self._cpu_clock()
+        # Below this CPU time, the thread was waiting in select/epoll, not working
+        idle_time = self.interval * 0.1 if is_cpu else 0
+        last = clock()
+        while not self.running.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            now = clock()
+            elapsed, last = now - last, now
+            if frame is None or elapsed <= idle_time:
+                continue
+
+            label = self._label(frame)
+            if label is not None:
+                self.samples += 1
+                self.cpu_times[label] += elapsed
+                self.stacks[f"{label};{self._collapse(frame)}"] += elapsed
+            del frame
+
+    def spider_opened(self, spider):
+        """
+        Start sampling the thread running the spider.
+        """
+
+        self.thread_id = threading.get_ident()
+        self._collect_labels(spider)
+        self.sampler = threading.Thread(target=self._sample, name="profiler", daemon=True)
+        self.sampler.start()
+
+    def _output_path(self, spider):
+        """
+        Get the profile path from the first feed, e.g. data/toscrape/20240616_115214.folded
+
+        The feed URI is filled with the same parameters as the feed exports (the
+        spider attributes, time, batch_time and batch_id of the first batch). A URI
+        using other parameters, or a remote feed, falls back to data/<spider>/<time>.folded.
+        """
+
+        settings = self.crawler.settings
+        now = datetime.now(tz=timezone.utc).isoformat().replace(":", "-")
+        fallback = Path("data", spider.name, f"{settings.get('CURRENT_TIME', now)}.folded")
+        feeds = settings.getdict("FEEDS")
+        if not feeds:
+            return fallback
+
+        params = {key: getattr(spider, key) for key in dir(spider) if not key.startswith("_")}
+        params.update(time=now, batch_time=now, batch_id=1)
+        try:
+            uri = str(next(iter(feeds))) % params
+        except (KeyError, TypeError, ValueError):
+            return fallback
+        if "://" in uri:
+            # Only local feeds can hold the profile next to them
+            parsed = urlparse(uri)
+            if parsed.scheme != "file":
+                return fallback
+            uri = parsed.path
+        return Path(uri).with_suffix(".folded")
+
+    def spider_closed(self, spider):
+        """
+        Stop sampling, write the collapsed stacks and the CPU time stats.
+        """
+
+        if self.sampler is None:
+            return
+
+        self.running.set()
+        self.sampler.join()
+
+        path = self._output_path(spider)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open("w", encoding="utf-8") as f:
+            for stack, cpu_time in self.stacks.most_common():
+                weight = round(cpu_time * 1_000_000)
+                if weight:
+                    f.write(f"{stack} {weight}\n")
+
+        stats = self.crawler.stats
+        stats.set_value("profiler/samples", self.samples, spider=spider)
+        for label, cpu_time in self.cpu_times.most_common():
+            stats.set_value(f"profiler/cpu_time/{label}", round(cpu_time, 3), spider=spider)
+        spider.logger.info(f"Profile written to {path}")
@@ -6,15 +6,41 @@ during the scraping process.
 """
 
 import time
+import asyncio
+import itertools
 import logging
+from collections import deque
 from scrapy import signals
+from scrapy.exceptions import IgnoreRequest, NotConfigured
 from scrapy.http import HtmlResponse
+from scrapy.utils.httpobj import urlparse_cached
+from twisted.internet.error import TimeoutError
 from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.common.by import By
 from fake_useragent import UserAgent
 
 # useful for handling different item types with a single interface
 # from itemadapter import is_item, ItemAdapter
 
+# Serialize only the elements matching the root selector (or the whole document),
+# optionally without scripts, styles and inline style attributes.
+PRUNE_SCRIPT = """
+const [root, strip] = arguments;
+const nodes = root ? document.querySelectorAll(root) : [document.documentElement];
+const parts = [];
+for (const node of nodes) {
+    const clone = node.cloneNode(true);
+    if (strip) {
+        clone.querySelectorAll("script, style, noscript, link[rel=stylesheet]")
+            .forEach((element) => element.remove());
+        clone.querySelectorAll("[style]").forEach((element) => element.removeAttribute("style"));
+    }
+    parts.push(clone.outerHTML);
+}
+return root ? "<html><body>" + parts.join("") + "</body></html>" : parts.join("");
+"""
+
 
 class ScraperSpiderMiddleware:
     """
@@ -87,6 +113,22 @@ class ScraperSpiderMiddleware:
 class ScraperDownloaderMiddleware:
     """
     Middleware for handling downloader actions.
+
+    Pages are rendered in tabs multiplexed inside a few Chrome processes instead of
+    one process per render. Each tab lives in its own browser context, so it has its
+    own cookies and storage, and its own user agent. Pages are loaded without waiting
+    for them, so the render wait of every tab runs concurrently. Browsers are launched
+    in a thread so that the reactor keeps running meanwhile.
+
+    Settings:
+        - SELENIUM_TABS_PER_BROWSER: Maximum number of tabs in each browser.
+        - SELENIUM_MAX_BROWSERS: Maximum number of browsers, launched when all tabs are busy.
+        - SELENIUM_RENDER_WAIT: Seconds to wait for a page to render.
+        - SELENIUM_LOAD_TIMEOUT: Seconds to wait for the page to be loaded after the render wait.
+        - SELENIUM_ALLOW_SHARED_TABS: Fall back to tabs sharing cookies when browser
+          contexts are not supported, instead of failing.
+        - SELENIUM_RANDOM_USER_AGENT: Give each tab a random user agent instead of USER_AGENT.
+        - SELENIUM_BAN_SELECTOR: CSS selector of block page elements (e.g. a captcha).
     """
     # Not all methods need to be defined. If a method is not defined,
     # scrapy acts as if the downloader middleware does not modify the
@@ -96,10 +138,21 @@ class ScraperDownloaderMiddleware:
     logging.getLogger("urllib3.connectionpool").setLevel(logging.INFO)
 
     def __init__(self, crawler):
-        options = webdriver.ChromeOptions()
-        options.add_argument("--headless=new")
-        options.add_argument("--user-agent=" + crawler.settings.get('USER_AGENT'))
-        self.driver = webdriver.Chrome(options=options)
+        settings = crawler.settings
+        self.user_agent = settings.get("USER_AGENT")
+        self.random_user_agent = settings.getbool("SELENIUM_RANDOM_USER_AGENT")
+        self.tabs_per_browser = max(1, settings.getint("SELENIUM_TABS_PER_BROWSER", 4))
+        self.max_browsers = max(1, settings.getint("SELENIUM_MAX_BROWSERS", 1))
+        self.render_wait = settings.getfloat("SELENIUM_RENDER_WAIT", 5)
+        self.load_timeout = settings.getfloat("SELENIUM_LOAD_TIMEOUT", 30)
+        self.allow_shared_tabs = settings.getbool("SELENIUM_ALLOW_SHARED_TABS")
+        self.stats = crawler.stats
+        self.strip = settings.getbool("SELENIUM_STRIP")
+        self.ban_selector = settings.get("SELENIUM_BAN_SELECTOR")
+        self.drivers = []
+        self.launching = 0
+        self.contexts = {}
+        self.tabs = None
 
     @classmethod
     def from_crawler(cls, crawler):
@@ -109,7 +162,135 @@ class ScraperDownloaderMiddleware:
         crawler.signals.connect(instance.spider_closed, signal=signals.spider_closed)
         return instance
 
-    def process_request(self, request, spider):
+    def _open_tab(self, driver):
+        """
+        Open a tab in a new browser context and set its user agent.
+
+        Chromedriver is expected to expose the target of the new context as a window
+        handle. If it doesn't, opening the tab fails, unless SELENIUM_ALLOW_SHARED_TABS
+        is set: the tab is then opened in the default context and shares cookies with
+        the other tabs of the browser.
+        """
+
+        handles = set(driver.window_handles)
+        context_id = None
+        try:
+            context_id = driver.execute_cdp_cmd("Target.createBrowserContext", {})["browserContextId"]
+            handle = driver.execute_cdp_cmd("Target.createTarget", {
+                "url": "about:blank",
+                "browserContextId": context_id,
+            })["targetId"]
+            if handle not in driver.window_handles:
+                new_handles = set(driver.window_handles) - handles
+                if len(new_handles) != 1:
+                    raise WebDriverException("The tab of the new browser context has no window handle")
+                handle = new_handles.pop()
+        except WebDriverException as e:
+            if context_id is not None:
+                driver.execute_cdp_cmd("Target.disposeBrowserContext", {"browserContextId": context_id})
+            if not self.allow_shared_tabs:
+                raise WebDriverException(
+                    f"Can't open an isolated tab ({e.msg}), set SELENIUM_ALLOW_SHARED_TABS to allow shared tabs"
+                )
+            logging.getLogger(__name__).warning(f"Tabs are not isolated, opening a shared tab: {e.msg}")
+            self.stats.inc_value("selenium/shared_tabs")
+            context_id = None
+            driver.switch_to.new_window("tab")
+            handle = driver.current_window_handle
+
+        self.contexts[handle] = context_id
+        driver.switch_to.window(handle)
+        user_agent = UserAgent().random if self.random_user_agent else self.user_agent
+        driver.execute_cdp_cmd("Emulation.setUserAgentOverride", {"userAgent": user_agent})
+        return handle
+
+    def _close_tab(self, driver, handle):
+        """
+        Close a tab and dispose of its browser context.
+        """
+
+        context_id = self.contexts.pop(handle, None)
+        driver.switch_to.window(handle)
+        driver.close()
+        if context_id is not None:
+            driver.execute_cdp_cmd("Target.disposeBrowserContext", {"browserContextId": context_id})
+
+    def _launch_browser(self):
+        """
+        Launch a browser and open its tabs. This runs in a thread and doesn't touch
+        the tab queue, the caller registers the browser and its tabs.
+        """
+
+        options = webdriver.ChromeOptions()
+        options.add_argument("--headless=new")
+        options.page_load_strategy = "none"
+        driver = webdriver.Chrome(options=options)
+
+        try:
+            default_handle = driver.current_window_handle
+            handles = [self._open_tab(driver) for _ in range(self.tabs_per_browser)]
+
+            # The default tab shares the default browser context, don't use it
+            driver.switch_to.window(default_handle)
+            driver.close()
+        except WebDriverException:
+            driver.quit()
+            raise
+        return driver, handles
+
+    def _quit_browser(self, driver):
+        """
+        Quit a broken browser, its tabs still in the queue are dropped when acquired.
+        """
+
+        if driver in self.drivers:
+            self.drivers.remove(driver)
+        try:
+            driver.quit()
+        except WebDriverException:
+            pass
+
+    def _replace_tab(self, driver, handle):
+        """
+        Replace a tab that failed with a new one, or quit its browser if the
+        browser itself is broken.
+        """
+
+        if driver not in self.drivers:
+            return
+
+        try:
+            self._close_tab(driver, handle)
+            self.tabs.put_nowait((driver, self._open_tab(driver)))
+        except WebDriverException:
+            self._quit_browser(driver)
+
+    async def _acquire_tab(self):
+        """
+        Get a free tab, launching a new browser if all tabs are busy and the
+        maximum number of browsers is not reached yet.
+        """
+
+        while True:
+            if self.tabs.empty() and len(self.drivers) + self.launching < self.max_browsers:
+                self.launching += 1
+                try:
+                    loop = asyncio.get_running_loop()
+                    driver, handles = await loop.run_in_executor(None, self._launch_browser)
+                finally:
+                    self.launching -= 1
+                self.drivers.append(driver)
+                for handle in handles:
+                    self.tabs.put_nowait((driver, handle))
+            try:
+                # Wake up regularly, a browser may have been quit in the meantime
+                driver, handle = await asyncio.wait_for(self.tabs.get(), timeout=1)
+            except asyncio.TimeoutError:
+                continue
+            if driver in self.drivers:
+                return driver, handle
+
+    async def process_request(self, request, spider):
         """
         Process each request through the downloader.
         """
@@ -120,13 +301,86 @@ class ScraperDownloaderMiddleware:
         # - or raise IgnoreRequest: process_exception() methods of
         #   installed downloader middleware will be called
 
-        self.driver.get(request.url)
-        time.sleep(5)
-        self.driver.execute_script("window.scrollTo(0, document.body.scrollHeight)")
-        body = self.driver.page_source
-        return HtmlResponse(
-            url=self.driver.current_url, body=body, encoding="utf-8", request=request
-        )
+        driver, handle = await self._acquire_tab()
+        broken = False
+        try:
+            # Driver calls don't yield to the event loop, so no other request can
+            # switch the driver to another tab between these calls.
+            driver.switch_to.window(handle)
+            # Mark the current document, the new one doesn't carry the mark
+            driver.execute_script("window.__scraperStale = true")
+            driver.get(request.url)
+            await asyncio.sleep(self.render_wait)
+            await self._wait_loaded(driver, handle, request)
+
+            driver.execute_script("window.scrollTo(0, document.body.scrollHeight)")
+            request.meta["selenium_banned"] = self._is_banned(driver, request)
+            body = self._page_source(driver, request)
+            url = driver.current_url
+        except WebDriverException:
+            broken = True
+            raise
+        finally:
+            # Only healthy tabs go back to the queue
+            if broken:
+                self._replace_tab(driver, handle)
+            else:
+                self.tabs.put_nowait((driver, handle))
+
+        return HtmlResponse(url=url, body=body, encoding="utf-8", request=request)
+
+    async def _wait_loaded(self, driver, handle, request):
+        """
+        Wait until the tab left the previous document and the new one is parsed.
+
+        Pages load without blocking, so a slow page may still be loading after the
+        render wait, while the tab still holds the previous document. If the page is
+        not loaded within SELENIUM_LOAD_TIMEOUT, the load is stopped and a timeout is
+        raised so the request is retried, instead of returning the previous page.
+        """
+
+        deadline = time.monotonic() + self.load_timeout
+        while True:
+            driver.switch_to.window(handle)
+            loading = driver.execute_script(
+                "return window.__scraperStale === true || document.readyState === 'loading'"
+            )
+            if not loading:
+                return
+            if time.monotonic() > deadline:
+                driver.execute_script("window.stop()")
+                raise TimeoutError(string=f"Page not loaded after {self.load_timeout}s: {request.url}")
+            await asyncio.sleep(0.2)
+
+    def _is_banned(self, driver, request):
+        """
+        Check whether the rendered page is a block page. Rendered pages always get
+        status 200, so the ban is reported in the selenium_banned meta key instead.
+
+        The CSS selector of block page elements is taken from the selenium_ban_selector
+        request meta key, or SELENIUM_BAN_SELECTOR.
+        """
+
+        selector = request.meta.get("selenium_ban_selector", self.ban_selector)
+        if not selector:
+            return False
+        return bool(driver.find_elements(By.CSS_SELECTOR, selector))
+
+    def _page_source(self, driver, request):
+        """
+        Serialize the rendered page inside the browser.
+
+        The following request meta keys prune the DOM before it is serialized:
+            - selenium_root: CSS selector, only the matching elements are returned.
+            - selenium_strip: Remove script, style and noscript elements and inline styles.
+        """
+
+        root = request.meta.get("selenium_root")
+        strip = request.meta.get("selenium_strip", self.strip)
+        if not root and not strip:
+            return driver.page_source
+
+        return driver.execute_script(PRUNE_SCRIPT, root, strip)
 
     def process_response(self, request, response, spider):
         """
@@ -152,17 +406,19 @@ class ScraperDownloaderMiddleware:
 
     def spider_opened(self, spider):
         """
-        Log when the spider is opened.
+        Create the queue of free tabs and log when the spider is opened.
         """
 
+        self.tabs = asyncio.Queue()
         spider.logger.info(f"Spider opened: {spider.name}")
 
     def spider_closed(self, spider):
         """
-        Quit the webdriver when the spider is closed.
+        Quit the webdrivers when the spider is closed.
         """
 
-        self.driver.quit()
+        for driver in list(self.drivers):
+            self._quit_browser(driver)
         spider.logger.info(f"Spider closed: {spider.name}")
 
 
@@ -178,3 +434,274 @@ class FakeUserAgentMiddleware:
 
         user_agent = UserAgent().random
         request.headers["User-Agent"] = user_agent
+
+
+class AdaptiveThrottleMiddleware:
+    """
+    Middleware for adapting concurrency and delay per domain.
+
+    The selenium middleware returns the response from process_request, so the request
+    never reaches the downloader slots and neither DOWNLOAD_DELAY nor AutoThrottle
+    apply to rendered pages. This middleware must run before it, it paces requests
+    itself and measures latency from here, browser render time included.
+
+    Responses with a status in ADAPTIVE_THROTTLE_BAN_CODES, or rendered block pages
+    flagged by the selenium middleware (selenium_banned meta key), count as bans.
+    The failure rate is the share of bans and errors in the last ADAPTIVE_THROTTLE_WINDOW
+    outcomes of a domain. Every ADAPTIVE_THROTTLE_WINDOW outcomes, concurrency and
+    delay are adjusted:
+        - Failure rate above ADAPTIVE_THROTTLE_MAX_ERROR_RATE: halve concurrency and
+          double the delay. This is also checked on every ban or error, so a burst
+          of failures backs off without waiting for the end of the window.
+        - Latency rising above the best observed latency: decrease concurrency by one.
+        - Otherwise: increase concurrency by one and shorten the delay.
+    After a backoff the window starts over, failures are not counted twice.
+    """
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        if not settings.getbool("ADAPTIVE_THROTTLE_ENABLED"):
+            raise NotConfigured("Adaptive throttle is disabled")
+
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.start_delay = settings.getfloat("ADAPTIVE_THROTTLE_START_DELAY", settings.getfloat("DOWNLOAD_DELAY"))
+        self.min_delay = settings.getfloat("ADAPTIVE_THROTTLE_MIN_DELAY", 0.0)
+        self.max_delay = settings.getfloat("ADAPTIVE_THROTTLE_MAX_DELAY", 60.0)
+        self.start_concurrency = settings.getint("ADAPTIVE_THROTTLE_START_CONCURRENCY", 1)
+        self.max_concurrency = settings.getint(
+            "ADAPTIVE_THROTTLE_MAX_CONCURRENCY", settings.getint("CONCURRENT_REQUESTS_PER_DOMAIN")
+        )
+        self.window = settings.getint("ADAPTIVE_THROTTLE_WINDOW", 20)
+        self.ban_codes = {int(code) for code in settings.getlist("ADAPTIVE_THROTTLE_BAN_CODES", [403, 429, 503])}
+        self.max_error_rate = settings.getfloat("ADAPTIVE_THROTTLE_MAX_ERROR_RATE", 0.05)
+        self.latency_tolerance = settings.getfloat("ADAPTIVE_THROTTLE_LATENCY_TOLERANCE", 0.5)
+        self.slot_timeout = settings.getfloat(
+            "ADAPTIVE_THROTTLE_SLOT_TIMEOUT", settings.getfloat("DOWNLOAD_TIMEOUT", 180)
+        )
+        self.slots = itertools.count()
+        self.domains = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        """Initialize the middleware."""
+        return cls(crawler)
+
+    def _domain(self, request):
+        """
+        Get the throttling state of the request's domain, creating it if needed.
+        """
+
+        domain = urlparse_cached(request).hostname or ""
+        if domain not in self.domains:
+            self.domains[domain] = {
+                "name": domain,
+                "delay": self.start_delay,
+                "concurrency": self.start_concurrency,
+                "in_flight": {},
+                "next_time": 0.0,
+                "latency": None,
+                "best_latency": None,
+                "outcomes": deque(maxlen=self.window),
+                "since_adjust": 0,
+            }
+        return self.domains[domain]
+
+    def _release_stale(self, domain, spider):
+        """
+        Release the slots held for longer than ADAPTIVE_THROTTLE_SLOT_TIMEOUT, e.g. by
+        a request that was replaced before any response or exception hook ran.
+        """
+
+        now = time.monotonic()
+        for slot, start in list(domain["in_flight"].items()):
+            if now - start > self.slot_timeout:
+                del domain["in_flight"][slot]
+                self.stats.inc_value("adaptive_throttle/stale_slots", spider=spider)
+                spider.logger.warning(f"Adaptive throttle released a stale slot for {domain['name']}")
+
+    async def process_request(self, request, spider):
+        """
+        Wait until the domain has a free slot and its delay has passed.
+        """
+
+        domain = self._domain(request)
+
+        # A request still holding a slot came back without being released
+        domain["in_flight"].pop(request.meta.pop("adaptive_throttle_slot", None), None)
+
+        while True:
+            # Don't hold the shutdown back for the length of the delay
+            engine = self.crawler.engine
+            if engine is not None and not engine.running:
+                raise IgnoreRequest("Engine stopped while the request was throttled")
+            self._release_stale(domain, spider)
+            wait = domain["next_time"] - time.monotonic()
+            if len(domain["in_flight"]) < domain["concurrency"] and wait <= 0:
+                break
+            await asyncio.sleep(min(max(wait, 0.05), 1.0))
+
+        slot = next(self.slots)
+        domain["in_flight"][slot] = time.monotonic()
+        domain["next_time"] = time.monotonic() + domain["delay"]
+        request.meta["adaptive_throttle_slot"] = slot
+
+    def _release(self, request):
+        """
+        Release the slot of the request, returning its domain and latency, or None
+        if the request holds no slot.
+        """
+
+        slot = request.meta.pop("adaptive_throttle_slot", None)
+        domain = self._domain(request)
+        start = domain["in_flight"].pop(slot, None)
+        if start is None:
+            return None, None
+        return domain, time.monotonic() - start
+
+    def process_response(self, request, response, spider):
+        """
+        Record latency and bans of the response.
+        """
+
+        domain, latency = self._release(request)
+        if domain is None:
+            return response
+
+        if domain["latency"] is None:
+            domain["latency"] = latency
+        else:
+            domain["latency"] = 0.7 * domain["latency"] + 0.3 * latency
+
+        banned = response.status in self.ban_codes or request.meta.get("selenium_banned", False)
+        if banned:
+            self.stats.inc_value("adaptive_throttle/bans", spider=spider)
+        self._record(domain, "ban" if banned else "ok", spider)
+        return response
+
+    def process_exception(self, request, exception, spider):
+        """
+        Record the error of the request.
+        """
+
+        domain, _ = self._release(request)
+        if domain is None:
+            return None
+
+        self.stats.inc_value("adaptive_throttle/errors", spider=spider)
+        self._record(domain, "error", spider)
+        return None
+
+    def _failure_rate(self, domain):
+        """
+        Get the share of bans and errors in the window of a domain. The rate is taken
+        over the full window size, so a window that is still filling up only exceeds
+        ADAPTIVE_THROTTLE_MAX_ERROR_RATE once enough failures happened.
+        """
+
+        failures = sum(1 for outcome in domain["outcomes"] if outcome != "ok")
+        return failures / self.window
+
+    def _record(self, domain, outcome, spider):
+        """
+        Record the outcome of a request ("ok", "ban" or "error") and adjust the
+        domain at the end of a window, or on a failure exceeding the failure rate.
+        """
+
+        domain["outcomes"].append(outcome)
+        domain["since_adjust"] += 1
+        if domain["since_adjust"] >= self.window:
+            self._adjust(domain, spider)
+        elif outcome != "ok" and self._failure_rate(domain) > self.max_error_rate:
+            self._adjust(domain, spider)
+
+    def _adjust(self, domain, spider):
+        """
+        Adjust concurrency and delay of a domain from its last window of outcomes.
+        """
+
+        failure_rate = self._failure_rate(domain)
+        latency = domain["latency"]
+        if latency is not None and (domain["best_latency"] is None or latency < domain["best_latency"]):
+            domain["best_latency"] = latency
+
+        if failure_rate > self.max_error_rate:
+            decision = "backoff"
+            domain["concurrency"] = max(1, domain["concurrency"] // 2)
+            domain["delay"] = min(self.max_delay, max(domain["delay"] * 2, 1.0))
+            domain["outcomes"].clear()
+        elif latency is not None and latency > domain["best_latency"] * (1 + self.latency_tolerance):
+            decision = "decrease"
+            domain["concurrency"] = max(1, domain["concurrency"] - 1)
+        else:
+            decision = "increase"
+            domain["concurrency"] = min(self.max_concurrency, domain["concurrency"] + 1)
+            domain["delay"] = max(self.min_delay, domain["delay"] * 0.75)
+
+        spider.logger.info(
+            f"Adaptive throttle {decision} for {domain['name']}: "
+            f"concurrency={domain['concurrency']} delay={domain['delay']:.2f}s "
+            f"latency={latency or 0:.2f}s failure_rate={failure_rate:.2f}"
+        )
+
+        prefix = f"adaptive_throttle/{domain['name']}"
+        self.stats.inc_value(f"adaptive_throttle/decisions/{decision}", spider=spider)
+        self.stats.set_value(f"{prefix}/concurrency", domain["concurrency"], spider=spider)
+        self.stats.set_value(f"{prefix}/delay", round(domain["delay"], 3), spider=spider)
+        self.stats.set_value(f"{prefix}/latency", round(latency or 0, 3), spider=spider)
+
+        domain["since_adjust"] = 0
+
+
+class AdaptiveThrottleReleaseMiddleware:
+    """
+    Middleware for releasing the slots taken by the adaptive throttle middleware.
+
+    Retry and redirect middlewares return a new request from process_response and
+    process_exception, which stops the chain before the adaptive throttle hooks run.
+    This middleware must run after them (priority above 600), so that responses and
+    exceptions reach it first and every outcome releases the slot of its request.
+    """
+
+    def __init__(self, crawler):
+        if not crawler.settings.getbool("ADAPTIVE_THROTTLE_ENABLED"):
+            raise NotConfigured("Adaptive throttle is disabled")
+
+        self.crawler = crawler
+        self.throttle = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        """Initialize the middleware."""
+        return cls(crawler)
+
+    def _throttle(self):
+        """
+        Get the enabled adaptive throttle middleware, if any.
+        """
+
+        if self.throttle is None:
+            for middleware in self.crawler.engine.downloader.middleware.middlewares:
+                if isinstance(middleware, AdaptiveThrottleMiddleware):
+                    self.throttle = middleware
+        return self.throttle
+
+    def process_response(self, request, response, spider):
+        """
+        Release the slot of the request and record its response.
+        """
+
+        throttle = self._throttle()
+        if throttle is None:
+            return response
+        return throttle.process_response(request, response, spider)
+
+    def process_exception(self, request, exception, spider):
+        """
+        Release the slot of the request and record its error.
+        """
+
+        throttle = self._throttle()
+        if throttle is not None:
+            throttle.process_exception(request, exception, spider)
+        return None
@@ -0,0 +1,44 @@
+"""
+Module for defining schedulers. This module contains a scheduler that keeps the
+crawl frontier on disk, so memory stays flat while the number of pending requests
+grows.
+
+Schedulers:
+- DiskScheduler: Scrapy scheduler that always spills pending requests to disk queues.
+"""
+
+import shutil
+import tempfile
+from scrapy.core.scheduler import Scheduler
+
+
+class DiskScheduler(Scheduler):
+    """
+    Scheduler that always pushes serializable requests to the disk queues.
+
+    The default scheduler only uses disk queues when JOBDIR is set and keeps every
+    pending request in memory otherwise. This scheduler falls back to a temporary
+    directory when JOBDIR is not set, which is removed when the spider closes.
+    With JOBDIR the queue is persisted there and resumed on the next run.
+    """
+
+    def _dqdir(self, jobdir):
+        """
+        Return the disk queue directory, creating a temporary one without JOBDIR.
+        """
+
+        self.tmpdir = None
+        if not jobdir:
+            self.tmpdir = tempfile.mkdtemp(prefix="scraper-scheduler-")
+            jobdir = self.tmpdir
+        return super()._dqdir(jobdir)
+
+    def close(self, reason):
+        """
+        Close the queues and remove the temporary queue directory, if any.
+        """
+
+        result = super().close(reason)
+        if self.tmpdir:
+            shutil.rmtree(self.tmpdir, ignore_errors=True)
+        return result
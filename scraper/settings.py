@@ -18,6 +18,7 @@ BOT_NAME = "scraper"
 
 SPIDER_MODULES = ["scraper.spiders"]
 NEWSPIDER_MODULE = "scraper.spiders"
+COMMANDS_MODULE = "scraper.commands"
 
 CURRENT_TIME = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
 
@@ -83,17 +84,52 @@ ROBOTSTXT_OBEY = True
 # Enable or disable downloader middlewares
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
 DOWNLOADER_MIDDLEWARES = {
+    "scraper.middlewares.AdaptiveThrottleMiddleware": 542,  # Must run before selenium
     "scraper.middlewares.ScraperDownloaderMiddleware": 543,
+    "scraper.middlewares.AdaptiveThrottleReleaseMiddleware": 950,  # Must run after retry and redirect
     # "scraper.middlewares.FakeUserAgentMiddleware": 544,  # Fake User-Agent Middleware
     # "rotating_proxies.middlewares.RotatingProxyMiddleware": 545,  # Proxies Middleware
     # "rotating_proxies.middlewares.BanDetectionMiddleware": 546,
 }
 
+# Strip script, style and noscript elements from pages rendered by Selenium.
+# Can be overridden per request with the "selenium_strip" meta key, and
+# "selenium_root" (CSS selector) serializes only the matching elements.
+SELENIUM_STRIP = False
+
+# Selenium renders pages in isolated tabs (own cookies and user agent) shared
+# inside a few browser processes, instead of one browser per render.
+SELENIUM_TABS_PER_BROWSER = 4
+SELENIUM_MAX_BROWSERS = 1
+# Seconds to wait for a page to render, tabs wait concurrently
+SELENIUM_RENDER_WAIT = 5
+# Seconds to wait for a page still loading after the render wait, before retrying it
+SELENIUM_LOAD_TIMEOUT = 30
+# Tabs are isolated in their own browser context, set to fall back to tabs sharing
+# cookies when the browser doesn't support it (counted in "selenium/shared_tabs")
+SELENIUM_ALLOW_SHARED_TABS = False
+# Give each tab a random user agent instead of USER_AGENT
+SELENIUM_RANDOM_USER_AGENT = False
+# CSS selector of block page elements, rendered pages matching it count as bans
+# for the adaptive throttle (rendered pages always have status 200)
+SELENIUM_BAN_SELECTOR = "iframe[src*='captcha'], #captcha, .g-recaptcha"
+
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
-# EXTENSIONS = {
-#    "scrapy.extensions.telnet.TelnetConsole": None,
-# }
+EXTENSIONS = {
+    # "scrapy.extensions.telnet.TelnetConsole": None,
+    "scraper.extensions.SamplingProfiler": 500,
+}
+
+# Sampling profiler, writes collapsed stacks next to the feed files
+# (data/spider_name/YYYYmmdd_HMS.folded) and CPU time per callback and pipeline
+# to the stats. E.g. scrapy crawl toscrape -s PROFILER_ENABLED=1
+PROFILER_ENABLED = False
+# Seconds between two samples
+PROFILER_INTERVAL = 0.01
+# Only profile these spider callbacks and pipeline classes (default: everything)
+PROFILER_CALLBACKS = []
+PROFILER_PIPELINES = []
 
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
@@ -102,6 +138,15 @@ DOWNLOADER_MIDDLEWARES = {
 #    "scraper.pipelines.LoadPostgresPipeline": 301,
 # }
 
+# Disk-backed dupefilter and scheduler, keeps memory flat on large crawls.
+# Set JOBDIR to persist seen requests and pending requests across restarts.
+# scrapy crawl toscrape -s JOBDIR=crawls/toscrape
+DUPEFILTER_CLASS = "scraper.dupefilters.BloomDupeFilter"
+SCHEDULER = "scraper.schedulers.DiskScheduler"
+# Expected number of unique requests and false positive rate of the Bloom filter
+DUPEFILTER_BLOOM_CAPACITY = 10_000_000
+DUPEFILTER_BLOOM_ERROR_RATE = 0.001
+
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
 # AUTOTHROTTLE_ENABLED = True
@@ -115,6 +160,29 @@ DOWNLOADER_MIDDLEWARES = {
 # Enable showing throttling stats for every response received:
 # AUTOTHROTTLE_DEBUG = False
 
+# Enable and configure the adaptive throttle middleware, which also measures the
+# selenium render time that AutoThrottle never sees. Decisions are logged and
+# exposed in the crawl stats under "adaptive_throttle/".
+ADAPTIVE_THROTTLE_ENABLED = True
+# The initial delay (default: DOWNLOAD_DELAY) and its bounds
+# ADAPTIVE_THROTTLE_START_DELAY = 1
+ADAPTIVE_THROTTLE_MIN_DELAY = 0
+ADAPTIVE_THROTTLE_MAX_DELAY = 60
+# The initial and maximum number of requests in parallel to each domain
+ADAPTIVE_THROTTLE_START_CONCURRENCY = 1
+ADAPTIVE_THROTTLE_MAX_CONCURRENCY = 8
+# Number of responses per domain between two adjustments, and over which the
+# ban/error rate is measured
+ADAPTIVE_THROTTLE_WINDOW = 20
+# Response codes counted as bans, and the ban/error rate that triggers a backoff
+# (with the defaults, 2 failures in the last 20 responses)
+ADAPTIVE_THROTTLE_BAN_CODES = [403, 429, 503]
+ADAPTIVE_THROTTLE_MAX_ERROR_RATE = 0.05
+# Relative latency increase over the best observed latency that decreases concurrency
+ADAPTIVE_THROTTLE_LATENCY_TOLERANCE = 0.5
+# Seconds after which a slot that was never released is freed (default: DOWNLOAD_TIMEOUT)
+# ADAPTIVE_THROTTLE_SLOT_TIMEOUT = 180
+
 # Enable and configure HTTP caching (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html#httpcache-middleware-settings
 # HTTPCACHE_ENABLED = True
@@ -129,6 +197,10 @@ TWISTED_REACTOR = "twisted.internet.asyncioreactor.AsyncioSelectorReactor"
 FEED_EXPORT_ENCODING = "utf-8-sig"
 LOG_LEVEL = "INFO"
 
+# Columnar archive of the run files, see `scrapy compact` and `scrapy history`
+ARCHIVE_DATA_DIR = "data"
+ARCHIVE_DIR = "archive"
+
 # Database connection details
 DATABASE_HOST = os.getenv("DATABASE_HOST")
 DATABASE_PORT = os.getenv("DATABASE_PORT")
@@ -25,7 +25,7 @@ class TokopediaSpider(scrapy.Spider):
         Update Scrapy Global settings for the tokopedia spider.
 
         Sets the following settings:
-            - DOWNLOAD_DELAY: Sets a delay of 1 second between consecutive requests.
+            - DOWNLOAD_DELAY: Sets a starting delay of 1 second, adjusted by the adaptive throttle.
             - ITEM_PIPELINES: Configures the pipeline to use 'LoadPostgresPipeline' with priority 301.
         """
 
@@ -46,13 +46,18 @@ class TokopediaSpider(scrapy.Spider):
         self.max_pages = 1
         self.base_url = self.start_urls[0] + "?ob=5&page={}"
         self.request_url = self.base_url.format(self.page)
+        # Only serialize the product cards rendered by the browser
+        self.render_meta = {
+            "selenium_root": ".css-bk6tzz.e1nlzfl2",
+            "selenium_strip": True,
+        }
 
     def start_requests(self):
         """
         Generate initial requests to the start URLs.
         """
 
-        yield scrapy.Request(url=self.request_url, callback=self.parse)
+        yield scrapy.Request(url=self.request_url, callback=self.parse, meta=self.render_meta)
 
     def parse(self, response, **kwargs):
         """
@@ -79,4 +84,4 @@ class TokopediaSpider(scrapy.Spider):
         if self.item_count < self.max_items:
             self.page += 1
             next_page_url = self.base_url.format(self.page)
-            yield scrapy.Request(url=next_page_url, callback=self.parse)
+            yield scrapy.Request(url=next_page_url, callback=self.parse, meta=self.render_meta)
@@ -0,0 +1,109 @@
+"""
+Tests for the decisions of the adaptive throttle middleware, fed with responses and
+errors directly, without a browser or a network.
+"""
+
+import pytest
+from scrapy import Request, Spider
+from scrapy.http import Response
+from scrapy.utils.test import get_crawler
+from twisted.internet.error import TimeoutError
+from scraper.middlewares import AdaptiveThrottleMiddleware
+
+
+@pytest.fixture
+def spider():
+    return Spider("throttle")
+
+
+@pytest.fixture
+def throttle():
+    crawler = get_crawler(Spider, {
+        "ADAPTIVE_THROTTLE_ENABLED": True,
+        "ADAPTIVE_THROTTLE_START_DELAY": 1,
+        "ADAPTIVE_THROTTLE_START_CONCURRENCY": 4,
+        "ADAPTIVE_THROTTLE_MAX_CONCURRENCY": 8,
+        "ADAPTIVE_THROTTLE_WINDOW": 20,
+        "ADAPTIVE_THROTTLE_MAX_ERROR_RATE": 0.05,
+    })
+    crawler.stats.open_spider(None)
+    return AdaptiveThrottleMiddleware.from_crawler(crawler)
+
+
+def hold_slot(throttle, url="http://example.com/"):
+    """Take a slot like process_request does, without waiting for it."""
+    request = Request(url)
+    domain = throttle._domain(request)
+    slot = next(throttle.slots)
+    domain["in_flight"][slot] = 0.0
+    request.meta["adaptive_throttle_slot"] = slot
+    return request, domain
+
+
+def respond(throttle, spider, status=200):
+    request, domain = hold_slot(throttle)
+    throttle.process_response(request, Response(request.url, status=status, request=request), spider)
+    return domain
+
+
+def fail(throttle, spider):
+    request, domain = hold_slot(throttle)
+    throttle.process_exception(request, TimeoutError(), spider)
+    return domain
+
+
+def test_single_error_does_not_back_off(throttle, spider):
+    for _ in range(5):
+        respond(throttle, spider)
+    domain = fail(throttle, spider)
+
+    assert domain["concurrency"] == 4
+    assert domain["delay"] == 1
+    assert throttle.stats.get_value("adaptive_throttle/decisions/backoff") is None
+
+
+def test_one_failure_per_window_does_not_back_off(throttle, spider):
+    for _ in range(3):
+        for _ in range(19):
+            domain = respond(throttle, spider)
+        domain = respond(throttle, spider, status=503)
+
+    assert throttle.stats.get_value("adaptive_throttle/decisions/backoff") is None
+    assert throttle.stats.get_value("adaptive_throttle/decisions/increase") == 3
+    assert domain["concurrency"] == 7
+
+
+def test_failures_above_rate_back_off_once(throttle, spider):
+    respond(throttle, spider, status=429)
+    domain = fail(throttle, spider)
+
+    assert throttle.stats.get_value("adaptive_throttle/decisions/backoff") == 1
+    assert domain["concurrency"] == 2
+    assert domain["delay"] == 2
+
+    # The window starts over, the next failure alone doesn't back off again
+    domain = fail(throttle, spider)
+    assert throttle.stats.get_value("adaptive_throttle/decisions/backoff") == 1
+    assert domain["delay"] == 2
+
+
+def test_rendered_ban_counts_as_failure(throttle, spider):
+    for _ in range(2):
+        request, domain = hold_slot(throttle)
+        request.meta["selenium_banned"] = True
+        throttle.process_response(request, Response(request.url, request=request), spider)
+
+    assert throttle.stats.get_value("adaptive_throttle/decisions/backoff") == 1
+
+
+def test_rising_latency_decreases_concurrency(throttle, spider):
+    for _ in range(20):
+        domain = respond(throttle, spider)
+    assert domain["concurrency"] == 5
+
+    # Latencies are measured from the slot start time, make them much longer
+    domain["best_latency"] = domain["latency"] / 10
+    for _ in range(20):
+        domain = respond(throttle, spider)
+    assert domain["concurrency"] == 4
+    assert throttle.stats.get_value("adaptive_throttle/decisions/decrease") == 1
@@ -0,0 +1,90 @@
+"""
+Smoke test for the tabs of the selenium middleware against a real Chrome. It checks
+that chromedriver accepts the targets of new browser contexts as window handles,
+and that tabs don't share cookies or user agents. Skipped when Chrome is not available.
+"""
+
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import pytest
+from scrapy import Request, Spider
+from scrapy.utils.test import get_crawler
+from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
+from scraper.middlewares import ScraperDownloaderMiddleware
+
+
+class EchoHandler(BaseHTTPRequestHandler):
+    """Set a cookie named after the path and echo the received cookies."""
+
+    def do_GET(self):
+        body = f"<html><body><p id='cookie'>{self.headers.get('Cookie', '')}</p></body></html>"
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Set-Cookie", f"tab={self.path.strip('/')}")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body.encode())
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def server():
+    httpd = HTTPServer(("127.0.0.1", 0), EchoHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{httpd.server_port}"
+    httpd.shutdown()
+
+
+@pytest.fixture(scope="module", autouse=True)
+def chrome():
+    options = webdriver.ChromeOptions()
+    options.add_argument("--headless=new")
+    try:
+        webdriver.Chrome(options=options).quit()
+    except WebDriverException as e:
+        pytest.skip(f"Chrome is not available: {e.msg}")
+
+
+def test_tabs_are_isolated(server):
+    crawler = get_crawler(Spider, {
+        "SELENIUM_TABS_PER_BROWSER": 2,
+        "SELENIUM_RENDER_WAIT": 1,
+        "SELENIUM_RANDOM_USER_AGENT": True,
+    })
+    spider = Spider("smoke")
+    middleware = ScraperDownloaderMiddleware.from_crawler(crawler)
+
+    async def render(path):
+        return await middleware.process_request(Request(server + path), spider)
+
+    async def crawl():
+        middleware.spider_opened(spider)
+        first = await asyncio.gather(render("/a"), render("/b"))
+        second = await asyncio.gather(render("/c"), render("/d"))
+        return first, second
+
+    try:
+        first, second = asyncio.run(crawl())
+        driver = middleware.drivers[0]
+        handles = list(middleware.contexts)
+        assert len(handles) == 2
+        assert all(middleware.contexts.values()), "tabs fell back to the shared context"
+        assert set(driver.window_handles) == set(handles)
+
+        # Each tab only sends back the cookie it received itself
+        for response in first:
+            assert response.css("#cookie::text").get() is None
+        cookies = sorted(response.css("#cookie::text").get() for response in second)
+        assert cookies == ["tab=a", "tab=b"]
+
+        user_agents = []
+        for handle in handles:
+            driver.switch_to.window(handle)
+            user_agents.append(driver.execute_script("return navigator.userAgent"))
+        assert len(set(user_agents)) == 2
+    finally:
+        middleware.spider_closed(spider)